@@ -1,12 +1,18 @@
 """
 Defines a volatile agent utilized in the model
 """
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import src.helpers as helper
 from src.migrate import volatile_loss
+from src.streams import RandomStreams
 
 RADIUS = helper.RAD_MERCURY
 N_MOLECULE = 100000
+# A hop keeps about a dozen float arrays the length of a chunk alive at once,
+# so 8192 volatiles (roughly 800 KiB) keeps them inside a 1 MiB L2 cache
+CHUNK_SIZE = 8192
+TILT_FRACTION = 0.1  # Share of weighted launches drawn from the shifted velocities
 
 np.random.seed(299)
 
@@ -18,25 +24,62 @@ class Volatile:
     along the surface of Mercury
     """
 
-    def __init__(self):
+    def __init__(
+        self, seed=None, prefetch=False, chunk_size=None, workers=None, tilt=None
+    ):
         """
         Set up the initial volatile characteristics that define important
         features of the volatile
+
+        Args:
+            seed: (int) The seed for the independent random streams of this
+            simulation (Uses the global generator by default)
+            prefetch: (bool) Whether or not to draw the random numbers for
+            the next hop on a worker thread while the current hop is calculated
+            chunk_size: (int) The number of volatiles in each chunk when a hop
+            is split across a thread pool, such as CHUNK_SIZE (Set to run the
+            whole population at once by default)
+            workers: (int) The number of threads used for chunks (Set to the
+            thread pool default by default)
+            tilt: (float) The number of standard deviations to shift a share
+            of the launch velocity draws towards escape, giving every volatile
+            a statistical weight (Set to unweighted volatiles by default)
         """
-        self.theta = np.random.rand(N_MOLECULE) * 2 * np.pi
-        self.phi = np.arccos(1 - 2 * np.random.rand(N_MOLECULE))
+        if prefetch and chunk_size is not None:
+            raise ValueError("prefetch cannot be combined with chunk_size")
+        self.streams = None
+        self.chunk_size = chunk_size
+        self.tilt = tilt
+        self._executor = None
+        if seed is not None or prefetch or chunk_size is not None:
+            self.streams = RandomStreams(N_MOLECULE, seed, prefetch)
+            self.theta = self.streams.position.random(N_MOLECULE) * 2 * np.pi
+            self.phi = np.arccos(1 - 2 * self.streams.position.random(N_MOLECULE))
+            self.emergent_angle = np.arccos(self.streams.position.random(N_MOLECULE))
+        else:
+            self.theta = np.random.rand(N_MOLECULE) * 2 * np.pi
+            self.phi = np.arccos(1 - 2 * np.random.rand(N_MOLECULE))
+            self.emergent_angle = np.array(
+                [helper.emergent_angle() for i in range(N_MOLECULE)]
+            )
+        if chunk_size is not None:
+            self._executor = ThreadPoolExecutor(max_workers=workers)
         self.temperature = helper.molecule_temperature(self.phi)
-        self.emergent_angle = np.array(
-            [helper.emergent_angle() for i in range(N_MOLECULE)]
-        )
         self.velocity = np.zeros(N_MOLECULE, dtype=float)
         self.time = np.zeros(N_MOLECULE, dtype=float)
+        self.weight = np.ones(N_MOLECULE, dtype=float)
+
+        # The weights of lost volatiles start with a zero to line up with the
+        # dummy value at the beginning of each position array
         self.photo_phi = np.empty(1)
         self.photo_theta = np.empty(1)
+        self.photo_weight = np.zeros(1)
         self.jeans_phi = np.empty(1)
         self.jeans_theta = np.empty(1)
+        self.jeans_weight = np.zeros(1)
         self.cold_phi = np.empty(1)
         self.cold_theta = np.empty(1)
+        self.cold_weight = np.zeros(1)
 
     def migrate(self, mass: float):
         """
@@ -46,43 +89,163 @@ class Volatile:
             mass: (float) The specific particle mass in kilograms
             of a specific volatile
         """
+        if self.chunk_size is not None:
+            self.migrate_chunked(mass)
+            self.control_population()
+            return
 
         # If the volatile hasn't been lost, then calculate where the volatile
         # will then end up as well as it's temperature and flight time
         # to find out if the volatile becomes lost in the next iteration
-        self.temperature = helper.molecule_temperature(self.phi)
-        self.velocity = pdf_velocity(self.temperature, mass)
-        self.emergent_angle = helper.emergent_angle()
-        height = helper.max_height(self.velocity, self.emergent_angle)
-        adj_gravity = helper.adjusted_gravity(height)
-        self.time = flight_time(self.velocity, self.emergent_angle, adj_gravity)
-        distance = helper.calc_distance(self.velocity, self.emergent_angle, adj_gravity)
-        radians = helper.calc_radians(distance)
-        heading = heading_direction()
-        self.calc_heading(radians, heading)
+        draws = (None, None, None, None)
+        if self.streams is not None:
+            draws = self.streams.next_hop(np.size(self.phi))
         (
+            self.temperature,
+            self.velocity,
+            self.emergent_angle,
+            self.time,
+            self.phi,
+            self.theta,
+            self.weight,
+            losses,
+        ) = hop(
             self.phi,
             self.theta,
+            self.weight,
+            self.losses(),
+            mass,
+            draws,
+            self.tilt,
+            self.weighting(),
+        )
+        self.set_losses(losses)
+        self.control_population()
+
+    def migrate_chunked(self, mass: float):
+        """
+        Allow the volatiles to undergo a hop in cache-sized chunks that are
+        spread across a thread pool
+
+        Args:
+            mass: (float) The specific particle mass in kilograms
+            of a specific volatile
+        """
+
+        if np.size(self.phi) == 0:
+            # Every volatile has been lost, so there is nothing left to move
+            self.temperature = np.empty(0)
+            self.velocity = np.empty(0)
+            self.time = np.empty(0)
+            return
+
+        # Every chunk draws from its own generator so the result does not
+        # depend on the order the threads finish in, while the launch angle
+        # and heading are still shared by the whole population
+        starts = range(0, np.size(self.phi), self.chunk_size)
+        generators = self.streams.chunk_generators(len(starts))
+        angle, heading = self.streams.hop_angles()
+        futures = [
+            self._executor.submit(
+                _hop_chunk,
+                self.phi[start : start + self.chunk_size],
+                self.theta[start : start + self.chunk_size],
+                self.weight[start : start + self.chunk_size],
+                mass,
+                generator,
+                angle,
+                heading,
+                self.tilt,
+            )
+            for start, generator in zip(starts, generators)
+        ]
+        chunks = [future.result() for future in futures]
+
+        # Merge the chunks back together in their original order
+        self.temperature = np.concatenate([chunk[0] for chunk in chunks])
+        self.velocity = np.concatenate([chunk[1] for chunk in chunks])
+        self.emergent_angle = chunks[0][2]
+        self.time = np.concatenate([chunk[3] for chunk in chunks])
+        self.phi = np.concatenate([chunk[4] for chunk in chunks])
+        self.theta = np.concatenate([chunk[5] for chunk in chunks])
+        self.weight = np.concatenate([chunk[6] for chunk in chunks])
+        self.set_losses(
+            np.concatenate([lost] + [chunk[7][i] for chunk in chunks])
+            for i, lost in enumerate(self.losses())
+        )
+
+    def control_population(self):
+        """
+        Split heavy volatiles and play Russian roulette with light ones when
+        the volatiles are weighted, keeping about N_MOLECULE active
+        """
+        if self.tilt is None:
+            return
+        self.phi, self.theta, self.weight = population_control(
+            self.phi, self.theta, self.weight, N_MOLECULE, self.weighting()
+        )
+
+    def weighting(self):
+        """
+        Find the generator used to weight the volatiles
+
+        Returns:
+            The generator for importance sampling and population control
+        """
+        if self.streams is None:
+            return np.random
+        return self.streams.weighting
+
+    def losses(self):
+        """
+        Collect the positions of every volatile lost so far
+
+        Returns:
+            The lattitude, longitude, and weight measurements of particles
+            caught by Jeans escape, cold traps, and photodestruction
+        """
+        return (
             self.jeans_phi,
             self.jeans_theta,
+            self.jeans_weight,
             self.cold_phi,
             self.cold_theta,
+            self.cold_weight,
             self.photo_phi,
             self.photo_theta,
-        ) = volatile_loss(
-            self.temperature,
-            self.velocity,
-            self.emergent_angle,
-            self.time,
-            self.phi,
-            self.theta,
+            self.photo_weight,
+        )
+
+    def set_losses(self, losses):
+        """
+        Store the positions of every volatile lost so far
+
+        Args:
+            losses: (tuple) The lattitude, longitude, and weight measurements
+            of particles caught by Jeans escape, cold traps, and photodestruction
+        """
+        (
             self.jeans_phi,
             self.jeans_theta,
+            self.jeans_weight,
             self.cold_phi,
             self.cold_theta,
+            self.cold_weight,
             self.photo_phi,
             self.photo_theta,
-        )
+            self.photo_weight,
+        ) = losses
+
+    def close(self):
+        """
+        Release the worker threads used to prefetch random numbers or run
+        chunks, if any
+        """
+        if self.streams is not None:
+            self.streams.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
 
     def calc_heading(self, arc, heading):
         """
@@ -93,21 +256,207 @@ class Volatile:
             travels at
             heading: The angle at which a volatile heads
         """
-        self.phi = (self.phi + arc * np.sin(heading)) % np.pi
-        self.theta = (self.theta + arc * np.cos(heading)) % 2 * np.pi
+        self.phi, self.theta = calc_heading(self.phi, self.theta, arc, heading)
 
 
-def heading_direction():
+def hop(
+    phi,
+    theta,
+    weight,
+    losses,
+    mass,
+    draws=(None, None, None, None),
+    tilt=None,
+    generator=np.random,
+):
+    """
+    Move a set of volatiles through a single hop and remove the ones
+    that are lost
+
+    Args:
+        phi: (float) The set of free particle's lattitude angle
+        theta: (float) The set of free particle's longitude angle
+        weight: (float) The set of free particle's statistical weights
+        losses: (tuple) The lattitude, longitude, and weight measurements of
+        particles caught by Jeans escape, cold traps, and photodestruction
+        mass: (float) The specific particle mass in kilograms
+        of a specific volatile
+        draws: (tuple) The normal variates, photodestruction variates, emergent
+        angle variate, and heading for the hop as given by RandomStreams
+        (Drawn from the global generator by default)
+        tilt: (float) The number of standard deviations to shift a share of
+        the launch velocity draws by (Set to no shift by default)
+        generator: (Generator) The generator used to pick which launches are
+        shifted (Set to the global generator by default)
+
+    Returns:
+        The temperature, launch velocity, emergent angle, and flight time of
+        the volatiles at the start of the hop, followed by the positions and
+        weights of the remaining volatiles and the updated losses
+    """
+    normal, probability, angle, heading = draws
+    if tilt is not None:
+        # Importance sample the launch velocity from a mixture of the usual
+        # normal distribution and one shifted towards the escape velocity,
+        # then correct each weight by the likelihood ratio so every loss tally
+        # stays unbiased. Keeping most of the mixture unshifted bounds the
+        # ratio so the weights cannot blow up over many hops.
+        if normal is None:
+            normal = generator.standard_normal(np.size(phi))
+        shifted = generator.random(np.size(phi)) < TILT_FRACTION
+        normal = normal + tilt * shifted
+        weight = weight / (
+            1 - TILT_FRACTION + TILT_FRACTION * np.exp(tilt * normal - tilt**2 / 2)
+        )
+    temperature, velocity, emergent_angle, time, phi, theta = trajectory(
+        phi, theta, mass, normal, angle, heading
+    )
+    phi, theta, weight, *losses = volatile_loss(
+        temperature,
+        velocity,
+        emergent_angle,
+        time,
+        phi,
+        theta,
+        weight,
+        *losses,
+        probability=probability,
+    )
+    return temperature, velocity, emergent_angle, time, phi, theta, weight, losses
+
+
+def trajectory(phi, theta, mass, normal=None, angle=None, heading=None):
+    """
+    Launch a set of volatiles and find where they land
+
+    Args:
+        phi: (float) The set of free particle's lattitude angle
+        theta: (float) The set of free particle's longitude angle
+        mass: (float) The specific particle mass in kilograms
+        of a specific volatile
+        normal: (float) The set of standard normal variates for the launch
+        velocities (Drawn from the global generator by default)
+        angle: (float) The uniform variate for the emergent angle
+        (Drawn from the global generator by default)
+        heading: (float) The heading direction (Drawn from the global
+        generator by default)
+
+    Returns:
+        The temperature, launch velocity, emergent angle, and flight time of
+        the volatiles, followed by the positions they land at
+    """
+    temperature = helper.molecule_temperature(phi)
+    velocity = pdf_velocity(temperature, mass, normal)
+    emergent_angle = helper.emergent_angle(angle)
+    height = helper.max_height(velocity, emergent_angle)
+    adj_gravity = helper.adjusted_gravity(height)
+    time = flight_time(velocity, emergent_angle, adj_gravity)
+    distance = helper.calc_distance(velocity, emergent_angle, adj_gravity)
+    radians = helper.calc_radians(distance)
+    heading = heading_direction(heading)
+    phi, theta = calc_heading(phi, theta, radians, heading)
+    return temperature, velocity, emergent_angle, time, phi, theta
+
+
+def _hop_chunk(phi, theta, weight, mass, generator, angle, heading, tilt):
+    """
+    Run a single chunk of volatiles through a hop on a worker thread
+
+    Args:
+        phi: (float) The chunk's lattitude angles
+        theta: (float) The chunk's longitude angles
+        weight: (float) The chunk's statistical weights
+        mass: (float) The specific particle mass in kilograms
+        of a specific volatile
+        generator: (Generator) The generator used only by this chunk
+        angle: (float) The uniform variate for the shared emergent angle
+        heading: (float) The shared heading direction
+        tilt: (float) The shift applied to the launch velocity draws, if any
+
+    Returns:
+        The same results as hop, with the losses of this chunk only
+    """
+    size = np.size(phi)
+    draws = (generator.standard_normal(size), generator.random(size), angle, heading)
+    losses = tuple(np.empty(0) for i in range(9))
+    return hop(phi, theta, weight, losses, mass, draws, tilt, generator)
+
+
+def population_control(phi, theta, weight, target, generator=np.random):
+    """
+    Split heavy volatiles into several copies and play Russian roulette with
+    light volatiles so the active population stays near a target size without
+    changing the expected weight
+
+    Args:
+        phi: (float) The set of free particle's lattitude angle
+        theta: (float) The set of free particle's longitude angle
+        weight: (float) The set of free particle's statistical weights
+        target: (int) The number of volatiles to keep active
+        generator: (Generator) The generator used for the roulette
+        (Set to the global generator by default)
+
+    Returns:
+        The positions and weights of the volatiles that remain
+    """
+    if np.size(weight) == 0:
+        return phi, theta, weight
+    average = np.sum(weight) / target
+
+    # Volatiles far lighter than average survive with a probability equal to
+    # their share of the average weight and carry the average weight onwards
+    light = weight < average / 2
+    survive = generator.random(np.size(weight)) * average < weight
+    keep = ~light | survive
+    weight = np.where(light, average, weight)[keep]
+    phi = phi[keep]
+    theta = theta[keep]
+
+    # Volatiles far heavier than average are split into equal copies
+    copies = np.where(weight > 2 * average, np.floor(weight / average), 1)
+    copies = copies.astype(int)
+    weight = np.repeat(weight / copies, copies)
+    phi = np.repeat(phi, copies)
+    theta = np.repeat(theta, copies)
+    return phi, theta, weight
+
+
+def calc_heading(phi, theta, arc, heading):
+    """
+    Calculate the new position of a set of volatiles
+
+    Args:
+        phi: (float) The set of free particle's lattitude angle
+        theta: (float) The set of free particle's longitude angle
+        arc: (float) The length of the arc mapped on a sphere a particle
+        travels at
+        heading: The angle at which a volatile heads
+
+    Returns:
+        The new lattitude and longitude angles of the volatiles
+    """
+    phi = (phi + arc * np.sin(heading)) % np.pi
+    theta = (theta + arc * np.cos(heading)) % 2 * np.pi
+    return phi, theta
+
+
+def heading_direction(heading=None):
     """
     Calculates the direction on the sphere the volatile goes in
 
+    Args:
+        heading: (float) A heading that has already been drawn
+        (Drawn from the global generator by default)
+
     Returns:
         The angle at which the volatile travels to as a unit vector
     """
-    return np.random.uniform(0, 2 * np.pi)
+    if heading is None:
+        heading = np.random.uniform(0, 2 * np.pi)
+    return heading
 
 
-def pdf_velocity(temperature, mass):
+def pdf_velocity(temperature, mass, normal=None):
     """
     Calculates the trajectory velocity of a given volatile
 
@@ -116,6 +465,8 @@ def pdf_velocity(temperature, mass):
         area within the simulation space
         mass: (float) The specific particle mass in kilograms
         of a specific volatile
+        normal: (float) The set of standard normal variates to scale into
+        velocities (Drawn from the global generator by default)
 
     Returns:
         The initial launch velocity of the particle
@@ -125,7 +476,10 @@ def pdf_velocity(temperature, mass):
     # the calculation is explained in further depth in the Jupyter notebook
 
     calc_velocity = (3 * helper.BOLTZMANN_CONSTANT * temperature / mass) ** 0.5
-    volatile_speed = np.random.normal(calc_velocity, calc_velocity)
+    if normal is None:
+        volatile_speed = np.random.normal(calc_velocity, calc_velocity)
+    else:
+        volatile_speed = calc_velocity + calc_velocity * normal
     # Handles the potential case of the velocity being less than zero
     return abs(volatile_speed)
 
@@ -0,0 +1,288 @@
+"""
+Store simulation results on disk so they are only calculated once
+"""
+import functools
+import glob
+import hashlib
+import os
+import zipfile
+import numpy as np
+import src.agents as agents
+from src.expectation import (
+    LOSS_NAMES,
+    calculate_statistics,
+    run_simulation,
+    selected_simulation,
+    statistical_significance,
+)
+
+CACHE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache"
+)
+CACHE_SIZE = 2**30  # 1 GiB
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """
+    Fingerprint the simulation code so results are recalculated when it changes
+
+    Returns:
+        A hash of every Python script in the src folder
+    """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))):
+        with open(path, "rb") as script:
+            digest.update(script.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+
+    """
+    A folder of compressed result arrays named by the hash of everything
+    used to calculate them, where the least recently used results are
+    removed once the folder grows past a size limit
+    """
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=CACHE_SIZE):
+        """
+        Set up the folder the results are stored in
+
+        Args:
+            directory: (str) The folder to store the results in
+            (Set to the .cache folder of the repository by default)
+            max_bytes: (int) The largest size the folder may reach in bytes
+            (Set to 1 GiB by default)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, *parts):
+        """
+        Hash a set of parameters together with the code version
+
+        Args:
+            parts: Any numbers, strings, or arrays that determine the result
+
+        Returns:
+            The hexadecimal hash used to name the result
+        """
+        digest = hashlib.sha256(code_version().encode())
+        for part in parts:
+            if isinstance(part, (list, tuple, np.ndarray)):
+                part = np.asarray(part)
+                digest.update(f"{part.dtype}{part.shape}".encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(repr(part).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def load(self, key):
+        """
+        Read a stored result and mark it as recently used
+
+        Args:
+            key: (str) The hash of the result
+
+        Returns:
+            A dictionary of the stored arrays, or None if there is no result
+            or it has been damaged or removed by another process
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as stored:
+                arrays = dict(stored)
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return None
+        return arrays
+
+    def store(self, key, **arrays):
+        """
+        Save a result and remove old results if the folder is too large
+
+        Args:
+            key: (str) The hash of the result
+            arrays: The arrays to store, by name
+        """
+
+        # Write to a temporary file first so a result is never half written
+        temporary = self._path(key) + f".{os.getpid()}.tmp"
+        with open(temporary, "wb") as output:
+            np.savez_compressed(output, **arrays)
+        os.replace(temporary, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used results until the folder fits in
+        its size limit
+        """
+
+        # Other processes sharing the folder may remove files at any point,
+        # so every file that has already disappeared is skipped
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            try:
+                status = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((status.st_mtime, status.st_size, path))
+        files.sort()
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def call(self, function, *args):
+        """
+        Calculate the result of a function, or read it if it has already
+        been calculated with the same arguments
+
+        Args:
+            function: The function to call, which returns a tuple of numbers
+            or arrays
+            args: The arguments passed to the function
+
+        Returns:
+            The result of the function
+        """
+        key = self.key(function.__module__, function.__qualname__, *args)
+        stored = self.load(key)
+        if stored is None:
+            result = function(*args)
+            self.store(key, **{f"arr_{i}": value for i, value in enumerate(result)})
+            return result
+        return tuple(stored[f"arr_{i}"][()] for i in range(len(stored)))
+
+    def _path(self, key):
+        """
+        Find the file a result is stored in
+
+        Args:
+            key: (str) The hash of the result
+
+        Returns:
+            The path to the file
+        """
+        return os.path.join(self.directory, key + ".npz")
+
+
+def cached_simulate(runs, simulations, seed, tilt=None, cache=None):
+    """
+    Runs the simulation a certain number of times, reusing every simulation
+    that has already been run with the same seed
+
+    Args:
+        runs: (int) The number of hops the volatiles in the simulation will make
+        simulations: (int) The number of times to run the simulation
+        seed: (int) The seed for the ensemble, which is required since only
+        repeatable results can be cached
+        tilt: (float) The shift used to importance sample launches towards
+        Jeans escape (Set to unweighted volatiles by default)
+        cache: (ResultCache) The cache to use (Set to the default folder
+        by default)
+
+    Returns:
+        The same results as simulate with the same seed
+    """
+    if seed is None:
+        raise ValueError("only seeded ensembles can be cached")
+    if cache is None:
+        cache = ResultCache()
+
+    # The number of simulations is left out of the key because simulation i
+    # only depends on the seed and i, so a smaller ensemble can be extended
+    key = cache.key("simulate", runs, seed, tilt, agents.N_MOLECULE)
+    stored = cache.load(key)
+    if stored is None:
+        stored = {
+            "photo_stats": np.empty(0),
+            "cold_stats": np.empty(0),
+            "jean_stats": np.empty(0),
+        }
+    completed = np.size(stored["photo_stats"])
+    random_selection = selected_simulation(simulations, seed)
+    changed = False
+
+    # The selected simulation depends on the size of the ensemble, so its
+    # final results are kept separately for every size that is asked for
+    selected = {name: f"{name}_{simulations}" for name in LOSS_NAMES}
+
+    for i in range(completed, simulations):
+        volatiles = run_simulation(runs, i, seed, tilt)
+        photo_total = np.sum(volatiles.photo_weight)
+        cold_total = np.sum(volatiles.cold_weight)
+        jean_total = np.sum(volatiles.jeans_weight)
+        stored["photo_stats"] = np.append(stored["photo_stats"], photo_total)
+        stored["cold_stats"] = np.append(stored["cold_stats"], cold_total)
+        stored["jean_stats"] = np.append(stored["jean_stats"], jean_total)
+        if i == random_selection:
+            for name, stored_name in selected.items():
+                stored[stored_name] = getattr(volatiles, name)
+        changed = True
+
+    # Rerun the selected simulation if it was already cached without its
+    # final results for this size of ensemble
+    if selected["cold_phi"] not in stored:
+        volatiles = run_simulation(runs, random_selection, seed, tilt)
+        for name, stored_name in selected.items():
+            stored[stored_name] = getattr(volatiles, name)
+        changed = True
+    if changed:
+        cache.store(key, **stored)
+
+    return (
+        list(stored["photo_stats"][:simulations]),
+        list(stored["cold_stats"][:simulations]),
+        list(stored["jean_stats"][:simulations]),
+        *(stored[stored_name] for stored_name in selected.values()),
+    )
+
+
+def cached_statistics(volatile_list, cache=None):
+    """
+    Calculates the statistics of a simulation result, reading them from the
+    cache if they have already been calculated
+
+    Args:
+        volatile_list: (list) A list of results from the simulation of how many
+        molecules were lost
+        cache: (ResultCache) The cache to use (Set to the default folder
+        by default)
+
+    Returns:
+        The same results as calculate_statistics
+    """
+    if cache is None:
+        cache = ResultCache()
+    return cache.call(calculate_statistics, volatile_list)
+
+
+def cached_significance(volatile_list, mean, cache=None):
+    """
+    Calculates the statistical significance of the data, reading it from the
+    cache if it has already been calculated
+
+    Args:
+        volatile_list: (list) A list of results from the simulation of how many
+        molecules were lost
+        mean: (float) The given mean of the volatiles landing in cold spots as
+        denoted by the paper
+        cache: (ResultCache) The cache to use (Set to the default folder
+        by default)
+
+    Returns:
+        The same results as statistical_significance
+    """
+    if cache is None:
+        cache = ResultCache()
+    return cache.call(statistical_significance, volatile_list, mean)
@@ -4,28 +4,44 @@ Calculate statistical parameters of every simulation run
 import numpy as np
 from src.agents import Volatile
 
-
-def simulate(runs, simulations):
+MAP_BINS = (18, 36)  # 10 degree bins in lattitude and longitude
+LOSS_NAMES = (
+    "cold_phi",
+    "cold_theta",
+    "jeans_phi",
+    "jeans_theta",
+    "photo_phi",
+    "photo_theta",
+    "cold_weight",
+    "jeans_weight",
+    "photo_weight",
+)
+
+
+def simulate(runs, simulations, tilt=None, seed=None):
     """
     Runs the simulation a certain number of times
 
     Args:
         runs: (int) The number of hops the volatiles in the simulation will make
         simulations: (int) The number of times to run the simulation
+        tilt: (float) The shift used to importance sample launches towards
+        Jeans escape (Set to unweighted volatiles by default)
+        seed: (int) The seed for the ensemble, which gives every simulation
+        its own repeatable random streams (Uses the global generator by default)
 
     Returns:
         A list of statisitcs for the photodestruction, cold traps, and jeans escape as well as the
-        final results of a randomly selected simulation
+        final results of a randomly selected simulation, followed by the weights of the lost
+        volatiles of that simulation so maps of weighted runs are not biased
     """
     photo_stats = []
     cold_stats = []
     jean_stats = []
-    random_selection = np.random.randint(0, simulations)
+    random_selection = selected_simulation(simulations, seed)
 
     for i in range(simulations):
-        volatiles = Volatile()
-        for j in range(runs):
-            volatiles.migrate(2.989e-26)
+        volatiles = run_simulation(runs, i, seed, tilt)
         if i == random_selection:
             cold_phi = volatiles.cold_phi
             cold_theta = volatiles.cold_theta
@@ -33,11 +49,16 @@ def simulate(runs, simulations):
             jeans_theta = volatiles.jeans_theta
             photo_phi = volatiles.photo_phi
             photo_theta = volatiles.photo_theta
-
-        # We must subtract by 1 since there is a dummy value at the beginning of each array
-        photo_stats.append(len(volatiles.photo_phi) - 1)
-        cold_stats.append(len(volatiles.cold_phi) - 1)
-        jean_stats.append(len(volatiles.jeans_phi) - 1)
+            cold_weight = volatiles.cold_weight
+            jeans_weight = volatiles.jeans_weight
+            photo_weight = volatiles.photo_weight
+
+        # Every volatile carries a statistical weight, which is 1 unless the
+        # launches are importance sampled, so the losses are weight sums.
+        # The dummy value at the beginning of each array has a weight of 0.
+        photo_stats.append(np.sum(volatiles.photo_weight))
+        cold_stats.append(np.sum(volatiles.cold_weight))
+        jean_stats.append(np.sum(volatiles.jeans_weight))
     return (
         photo_stats,
         cold_stats,
@@ -48,6 +69,86 @@ def simulate(runs, simulations):
         jeans_theta,
         photo_phi,
         photo_theta,
+        cold_weight,
+        jeans_weight,
+        photo_weight,
+    )
+
+
+def run_simulation(runs, index, seed=None, tilt=None):
+    """
+    Runs a single simulation of an ensemble
+
+    Args:
+        runs: (int) The number of hops the volatiles in the simulation will make
+        index: (int) The position of the simulation within the ensemble
+        seed: (int) The seed for the ensemble (Uses the global generator
+        by default)
+        tilt: (float) The shift used to importance sample launches towards
+        Jeans escape (Set to unweighted volatiles by default)
+
+    Returns:
+        The volatiles after every hop has been made
+    """
+
+    # Each simulation seeds its streams from its own position in the ensemble,
+    # so it gives the same result no matter how many simulations are run
+    if seed is not None:
+        seed = np.random.SeedSequence(seed, spawn_key=(index,))
+    volatiles = Volatile(seed=seed, tilt=tilt)
+    for j in range(runs):
+        volatiles.migrate(2.989e-26)
+    volatiles.close()
+    return volatiles
+
+
+def selected_simulation(simulations, seed=None):
+    """
+    Picks the simulation of an ensemble whose final results are kept
+
+    Args:
+        simulations: (int) The number of times to run the simulation
+        seed: (int) The seed for the ensemble (Uses the global generator
+        by default)
+
+    Returns:
+        The index of the randomly selected simulation
+    """
+    if seed is None:
+        return np.random.randint(0, simulations)
+    return int(np.random.default_rng(seed).integers(0, simulations))
+
+
+def loss_maps(volatiles, bins=MAP_BINS):
+    """
+    Bins where the volatiles of a simulation were lost on the surface
+
+    Args:
+        volatiles: (Volatile) The volatiles after every hop has been made
+        bins: (tuple) The number of lattitude and longitude bins
+        (Set to 10 degree bins by default)
+
+    Returns:
+        An array of the total weight lost in each bin by Jeans escape,
+        cold traps, and photodestruction
+    """
+    losses = (
+        (volatiles.jeans_phi, volatiles.jeans_theta, volatiles.jeans_weight),
+        (volatiles.cold_phi, volatiles.cold_theta, volatiles.cold_weight),
+        (volatiles.photo_phi, volatiles.photo_theta, volatiles.photo_weight),
+    )
+    # We skip the dummy value at the beginning of each array
+    return np.array(
+        [
+            np.histogram2d(
+                phi[1:],
+                theta[1:],
+                bins=bins,
+                range=((0, np.pi), (0, 2 * np.pi)),
+                weights=weight[1:],
+            )[0]
+            for phi, theta, weight in losses
+        ]
     )
 
 
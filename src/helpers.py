@@ -58,15 +58,21 @@ def launch_velocity(temperature, volatile):
     return (3 * BOLTZMANN_CONSTANT * temperature / CARBON_DIOXIDE_MASS) ** 0.5
 
 
-def emergent_angle():
+def emergent_angle(probability=None):
     """
     Calculates the angle in reference to the ground of the simulation
 
+    Args:
+        probability: (float) A uniform random number to map onto the
+        launch angle (Drawn from the global generator by default)
+
     Returns:
         The angle (psi) that the volatile launches at
     """
 
-    return np.arccos(np.random.uniform())
+    if probability is None:
+        probability = np.random.uniform()
+    return np.arccos(probability)
 
 
 def adjusted_gravity(height):
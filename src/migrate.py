@@ -17,13 +17,18 @@ def volatile_loss(
     time,
     phi,
     theta,
+    weight,
     jeans_phi,
     jeans_theta,
+    jeans_weight,
     cold_phi,
     cold_theta,
+    cold_weight,
     photo_phi,
     photo_theta,
+    photo_weight,
     volatile="water",
+    probability=None,
 ):
     """
     Determine how a volatile might've been lost or if it continues to migrate
@@ -38,23 +43,33 @@ def volatile_loss(
         will remain in the air for a jump
         phi: (float) The set of free particle's lattitude angle
         theta: (float) The set of free particle's longitude angle
+        weight: (float) The set of free particle's statistical weights
         jeans_phi: (float) The set of lattitude measurements of
         particles caught by Jeans escape
         jeans_theta: (float) The set of longitude measurements of
         particles caught by Jeans escape
+        jeans_weight: (float) The set of weights of particles caught
+        by Jeans escape
         cold_phi: (float) The set of lattitude measurements of
         particles caught by cold trap
         cold_theta: (float) The set of longitude measurements of
         particles caught by cold trap
+        cold_weight: (float) The set of weights of particles caught
+        by cold trap
         photo_phi: (float) The set of lattitude measurements of
         particles caught by photodestruction
         photo_theta: (float) The set of longitude measurements of
         particles caught by photodestruction
+        photo_weight: (float) The set of weights of particles caught
+        by photodestruction
         volatile: (string) The specified volatile used in the simulation
         (Set to water by default)
+        probability: (float) The set of uniform random numbers used to decide
+        photodestruction (Drawn from the global generator by default)
 
     Returns:
-        All set of the particles position that are either lost or active in the simulation
+        All set of the particles position and weight that are either lost or active
+        in the simulation
     """
 
     # First check to see if the volatile has exceeded the vertical
@@ -65,15 +80,26 @@ def volatile_loss(
     # volatile is lost through only one method. Jeans escape only requires velocity and
     # the emergent angle of the system.
 
-    jeans_phi, jeans_theta, time, temperature, phi, theta = jeans_escape(
+    (
+        jeans_phi,
+        jeans_theta,
+        jeans_weight,
+        time,
+        temperature,
+        phi,
+        theta,
+        weight,
+    ) = jeans_escape(
         velocity,
         emergent_angle,
         temperature,
         time,
         phi,
         theta,
+        weight,
         jeans_phi,
         jeans_theta,
+        jeans_weight,
     )
 
     # Next check to see if the volatile has migrated to a cold
@@ -84,27 +110,39 @@ def volatile_loss(
     # volatile is lost through only one method. The only factor relevant to the cold trap
     # is the temperature the molecule is at.
 
-    cold_phi, cold_theta, time, phi, theta = cold_trap(
-        temperature, time, phi, theta, cold_phi, cold_theta
+    cold_phi, cold_theta, cold_weight, time, phi, theta, weight = cold_trap(
+        temperature, time, phi, theta, weight, cold_phi, cold_theta, cold_weight
     )
 
     # Finally, check to see if the volatile has encounter photodestruction
-    photo_phi, photo_theta, phi, theta = photodestruction(
-        time, phi, theta, photo_phi, photo_theta, volatile
+    photo_phi, photo_theta, photo_weight, phi, theta, weight = photodestruction(
+        time,
+        phi,
+        theta,
+        weight,
+        photo_phi,
+        photo_theta,
+        photo_weight,
+        volatile,
+        probability,
     )
     return (
         phi,
         theta,
+        weight,
         jeans_phi,
         jeans_theta,
+        jeans_weight,
         cold_phi,
         cold_theta,
+        cold_weight,
         photo_phi,
         photo_theta,
+        photo_weight,
     )
 
 
-def cold_trap(temperature, time, phi, theta, cold_phi, cold_theta):
+def cold_trap(temperature, time, phi, theta, weight, cold_phi, cold_theta, cold_weight):
     """
     Determine whether or not the volatile steps into the territory of a
     cold trap
@@ -115,22 +153,29 @@ def cold_trap(temperature, time, phi, theta, cold_phi, cold_theta):
         will remain in the air for a jump
         phi: (float) The set of free particle's lattitude angle
         theta: (float) The set of free particle's longitude angle
+        weight: (float) The set of free particle's statistical weights
         cold_phi: (float) The set of lattitude measurements of
         particles caught by cold trap
         cold_theta: (float) The set of longitude measurements of
         particles caught by cold trap
+        cold_weight: (float) The set of weights of particles caught
+        by cold trap
 
     Returns:
         The set of positions of particles that are lost due to cold traps
         or maintained in the system
     """
-    sparse_indicies = list(spf(temperature <= kine.COLD_TRAP))[1]
+    sparse_indicies = list(spf(is_cold_trapped(temperature)))[1]
     cold_phi = np.concatenate((cold_phi, np.take(phi, sparse_indicies, axis=0)))
     cold_theta = np.concatenate((cold_theta, np.take(theta, sparse_indicies, axis=0)))
+    cold_weight = np.concatenate(
+        (cold_weight, np.take(weight, sparse_indicies, axis=0))
+    )
     phi = np.delete(phi, sparse_indicies)
     theta = np.delete(theta, sparse_indicies)
+    weight = np.delete(weight, sparse_indicies)
     time = np.delete(time, sparse_indicies)
-    return cold_phi, cold_theta, time, phi, theta
+    return cold_phi, cold_theta, cold_weight, time, phi, theta, weight
 
 
 def jeans_escape(
@@ -140,8 +185,10 @@ def jeans_escape(
     time,
     phi,
     theta,
+    weight,
     jeans_phi,
     jeans_theta,
+    jeans_weight,
 ):
     """
     Determine whether or not the volatile escapes the atmosphere due
@@ -157,27 +204,43 @@ def jeans_escape(
         will remain in the air for a jump
         phi: (float) The set of free particle's lattitude angle
         theta: (float) The set of free particle's longitude angle
-        photo_phi: (float) The set of lattitude measurements of
-        particles caught by photodestruction
-        photo_theta: (float) The set of longitude measurements of
-        particles caught by photodestruction
+        weight: (float) The set of free particle's statistical weights
+        jeans_phi: (float) The set of lattitude measurements of
+        particles caught by Jeans escape
+        jeans_theta: (float) The set of longitude measurements of
+        particles caught by Jeans escape
+        jeans_weight: (float) The set of weights of particles caught
+        by Jeans escape
 
     Returns:
         The set of positions of particles that are lost due to exceeding the
         escape velocity or the set of particles that could not escape
     """
-    vert_velocity = velocity * np.sin(emergent_angle)
-    sparse_indicies = list(spf(vert_velocity >= kine.ESC_MERCURY))[1]
+    sparse_indicies = list(spf(is_escaping(velocity, emergent_angle)))[1]
     jeans_phi = np.concatenate((jeans_phi, np.take(phi, sparse_indicies, axis=0)))
     jeans_theta = np.concatenate((jeans_theta, np.take(theta, sparse_indicies, axis=0)))
+    jeans_weight = np.concatenate(
+        (jeans_weight, np.take(weight, sparse_indicies, axis=0))
+    )
     phi = np.delete(phi, sparse_indicies)
     theta = np.delete(theta, sparse_indicies)
+    weight = np.delete(weight, sparse_indicies)
     time = np.delete(time, sparse_indicies)
     temperature = np.delete(temperature, sparse_indicies)
-    return jeans_phi, jeans_theta, time, temperature, phi, theta
+    return jeans_phi, jeans_theta, jeans_weight, time, temperature, phi, theta, weight
 
 
-def photodestruction(time, phi, theta, photo_phi, photo_theta, volatile="water"):
+def photodestruction(
+    time,
+    phi,
+    theta,
+    weight,
+    photo_phi,
+    photo_theta,
+    photo_weight,
+    volatile="water",
+    probability=None,
+):
     """
     Determine whether or not the volatile cannot continue in the
     simulation due to photodestruction
@@ -187,28 +250,87 @@ def photodestruction(time, phi, theta, photo_phi, photo_theta, volatile="water")
         will remain in the air for a jump
         phi: (float) The set of free particle's lattitude angle
         theta: (float) The set of free particle's longitude angle
+        weight: (float) The set of free particle's statistical weights
         photo_phi: (float) The set of lattitude measurements of
         particles caught by photodestruction
         photo_theta: (float) The set of longitude measurements of
         particles caught by photodestruction
+        photo_weight: (float) The set of weights of particles caught
+        by photodestruction
         volatile: (string) The specified volatile used in the simulation
         (Set to water by default)
+        probability: (float) The set of uniform random numbers used to decide
+        photodestruction, at least as long as time (Drawn from the global
+        generator by default)
 
     Returns:
         The set of positions of particles that are destroyed by light
         or have stayed in the simulation
     """
-    if volatile == "water":
-        timescale = PHOTO_WATER
-    elif volatile == "carbon_dioxide":
-        timescale = PHOTO_CARBON_DIOXIDE
+    probability_factor = photo_probability(time, volatile)
+    if probability is None:
+        probability = np.random.rand(np.size(time, axis=0))
     else:
-        timescale = PHOTO_WATER
-    probability_factor = 1 - np.exp(-1 * (time / timescale))
-    probability = np.random.rand(np.size(time, axis=0))
+        probability = probability[: np.size(time, axis=0)]
     sparse_indicies = list(spf(probability < probability_factor))[1]
     photo_phi = np.concatenate((photo_phi, np.take(phi, sparse_indicies, axis=0)))
     photo_theta = np.concatenate((photo_theta, np.take(theta, sparse_indicies, axis=0)))
+    photo_weight = np.concatenate(
+        (photo_weight, np.take(weight, sparse_indicies, axis=0))
+    )
     phi = np.delete(phi, sparse_indicies)
     theta = np.delete(theta, sparse_indicies)
-    return photo_phi, photo_theta, phi, theta
+    weight = np.delete(weight, sparse_indicies)
+    return photo_phi, photo_theta, photo_weight, phi, theta, weight
+
+
+def is_cold_trapped(temperature):
+    """
+    Determine which volatiles are cold enough to be caught by a cold trap
+
+    Args:
+        temperature: (float) The temperature of a volatile in Kelvin
+
+    Returns:
+        Whether or not each volatile is caught by a cold trap
+    """
+    return temperature <= kine.COLD_TRAP
+
+
+def is_escaping(velocity, emergent_angle):
+    """
+    Determine which volatiles exceed the vertical escape velocity of Mercury
+
+    Args:
+        velocity: (float) The magnitude of the initial trajectory
+        velocity in meters per second
+        emergent_angle: (float) The launch angle in radians off of the
+        ground when the volatile jumps
+
+    Returns:
+        Whether or not each volatile escapes by Jeans escape
+    """
+    vert_velocity = velocity * np.sin(emergent_angle)
+    return vert_velocity >= kine.ESC_MERCURY
+
+
+def photo_probability(time, volatile="water"):
+    """
+    Calculate the chance a volatile is destroyed by light during a hop
+
+    Args:
+        time: (float) The amount of time in seconds a volatile
+        will remain in the air for a jump
+        volatile: (string) The specified volatile used in the simulation
+        (Set to water by default)
+
+    Returns:
+        The probability of photodestruction for each volatile
+    """
+    if volatile == "water":
+        timescale = PHOTO_WATER
+    elif volatile == "carbon_dioxide":
+        timescale = PHOTO_CARBON_DIOXIDE
+    else:
+        timescale = PHOTO_WATER
+    return 1 - np.exp(-1 * (time / timescale))
@@ -0,0 +1,483 @@
+"""
+Spread the simulations of an ensemble across workers on several machines
+"""
+import argparse
+import os
+import socket
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
+import numpy as np
+import src.agents as agents
+from src.expectation import (
+    LOSS_NAMES,
+    MAP_BINS,
+    loss_maps,
+    run_simulation,
+    selected_simulation,
+    simulate,
+)
+
+SHARD_SIZE = 10  # Simulations handed to a worker at a time
+SHARD_TIMEOUT = 3600  # Seconds to wait for a shard before reissuing it
+WORKER_TIMEOUT = 600  # Seconds to wait without any connected worker
+HANDSHAKE_TIMEOUT = 10  # Seconds a new connection has to authenticate
+
+
+def run_shard(runs, seed, start, stop, tilt=None, selection=None, bins=MAP_BINS):
+    """
+    Runs a range of simulations from a seeded ensemble
+
+    Args:
+        runs: (int) The number of hops the volatiles in the simulation will make
+        seed: (int) The seed for the ensemble
+        start: (int) The index of the first simulation to run
+        stop: (int) The index after the last simulation to run
+        tilt: (float) The shift used to importance sample launches towards
+        Jeans escape (Set to unweighted volatiles by default)
+        selection: (int) The index of the simulation whose final results
+        are kept (Set to none by default)
+        bins: (tuple) The number of lattitude and longitude bins for the loss
+        maps (Set to 10 degree bins by default)
+
+    Returns:
+        A dictionary of the losses of each simulation by method, the loss maps
+        of each simulation, and the final results of the selected simulation
+        if it is part of the shard
+    """
+    result = {"photo_stats": [], "cold_stats": [], "jean_stats": [], "maps": []}
+    for i in range(start, stop):
+        volatiles = run_simulation(runs, i, seed, tilt)
+        result["photo_stats"].append(np.sum(volatiles.photo_weight))
+        result["cold_stats"].append(np.sum(volatiles.cold_weight))
+        result["jean_stats"].append(np.sum(volatiles.jeans_weight))
+        result["maps"].append(loss_maps(volatiles, bins))
+        if i == selection:
+            result.update({name: getattr(volatiles, name) for name in LOSS_NAMES})
+    return result
+
+
+class Coordinator:
+
+    """
+    Hand out shards of a seeded ensemble to workers over TCP and merge their
+    results in a fixed order, reissuing the shards of workers that fail
+    """
+
+    def __init__(
+        self,
+        runs,
+        simulations,
+        seed,
+        tilt=None,
+        shard_size=SHARD_SIZE,
+        address=("localhost", 0),
+        authkey=None,
+        timeout=SHARD_TIMEOUT,
+        handshake_timeout=HANDSHAKE_TIMEOUT,
+    ):
+        """
+        Split the ensemble into shards and start listening for workers
+
+        Args:
+            runs: (int) The number of hops the volatiles in the simulation
+            will make
+            simulations: (int) The number of times to run the simulation
+            seed: (int) The seed for the ensemble
+            tilt: (float) The shift used to importance sample launches towards
+            Jeans escape (Set to unweighted volatiles by default)
+            shard_size: (int) The number of simulations in each shard
+            (Set to SHARD_SIZE by default)
+            address: (tuple) The host and port to listen on (Set to a free
+            port on localhost by default)
+            authkey: (bytes) The key workers must present to connect. Workers
+            are sent pickled objects, so the key must be kept secret (Set to a
+            random key that is printed by default)
+            timeout: (float) The number of seconds to wait for a shard before
+            handing it to another worker (Set to SHARD_TIMEOUT by default)
+            handshake_timeout: (float) The number of seconds a new connection
+            has to authenticate before it is dropped (Set to HANDSHAKE_TIMEOUT
+            by default)
+        """
+        self.runs = runs
+        self.simulations = simulations
+        self.seed = seed
+        self.tilt = tilt
+        self.timeout = timeout
+        self.handshake_timeout = handshake_timeout
+        self.selection = selected_simulation(simulations, seed)
+        self.shards = [
+            (start, min(start + shard_size, simulations))
+            for start in range(0, simulations, shard_size)
+        ]
+        if authkey is None:
+            authkey = os.urandom(32)
+            print(f"Workers must connect with --authkey {authkey.hex()}")
+        self.authkey = authkey
+        self.listener = socket.create_server(address)
+        self.address = self.listener.getsockname()[:2]
+
+        self._pending = list(range(len(self.shards)))[::-1]
+        self._results = {}
+        self._merged = 0
+        self._workers = 0
+        self._condition = threading.Condition()
+
+        # Merged results, built up in shard order as shards come in
+        self.photo_stats = []
+        self.cold_stats = []
+        self.jean_stats = []
+        self.loss_maps = np.zeros((3, *MAP_BINS))
+        self.selected = None
+
+    def serve(self, worker_timeout=WORKER_TIMEOUT):
+        """
+        Hand out shards until every shard has been merged
+
+        Args:
+            worker_timeout: (float) The number of seconds to wait while no
+            worker is connected before giving up (Set to WORKER_TIMEOUT
+            by default)
+
+        Returns:
+            The same results as simulate with the same seed. The summed loss
+            maps are stored in loss_maps.
+        """
+        threading.Thread(target=self._accept, daemon=True).start()
+        last_worker = time.monotonic()
+        with self._condition:
+            while self._merged < len(self.shards):
+                if self._workers > 0:
+                    last_worker = time.monotonic()
+                elif time.monotonic() - last_worker > worker_timeout:
+                    self.listener.close()
+                    raise TimeoutError(
+                        f"no worker connected for {worker_timeout} seconds with "
+                        f"{len(self.shards) - self._merged} shards left"
+                    )
+                self._condition.wait(timeout=1)
+        self.listener.close()
+        return (
+            self.photo_stats,
+            self.cold_stats,
+            self.jean_stats,
+            *(self.selected[name] for name in LOSS_NAMES),
+        )
+
+    def _accept(self):
+        """
+        Start a thread for every worker that connects
+        """
+
+        # Authentication happens on each connection's own thread so that a
+        # connection with the wrong key or one that never answers cannot stop
+        # other workers from joining
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(sock,), daemon=True).start()
+
+    def _handle(self, sock):
+        """
+        Authenticate a new connection and send shards to it until there are
+        none left
+
+        Args:
+            sock: (socket) The socket the worker connected on
+        """
+        try:
+            connection = _handshake(sock, self.authkey, True, self.handshake_timeout)
+        except (AuthenticationError, OSError, EOFError):
+            return
+        with self._condition:
+            self._workers += 1
+        try:
+            self._serve_worker(connection)
+        finally:
+            with self._condition:
+                self._workers -= 1
+                self._condition.notify_all()
+
+    def _serve_worker(self, connection):
+        """
+        Send shards over a worker's connection until there are none left or
+        the worker fails
+
+        Args:
+            connection: (Connection) The connection to the worker
+        """
+        with connection:
+            while True:
+                index = self._next_shard()
+                if index is None:
+                    try:
+                        connection.send(None)
+                    except OSError:
+                        pass
+                    return
+                start, stop = self.shards[index]
+                try:
+                    connection.send(
+                        {
+                            "runs": self.runs,
+                            "seed": self.seed,
+                            "start": start,
+                            "stop": stop,
+                            "tilt": self.tilt,
+                            "selection": self.selection,
+                        }
+                    )
+                    if not connection.poll(self.timeout):
+                        raise TimeoutError
+                    result = connection.recv()
+                except (OSError, EOFError):
+                    # The worker failed or stopped responding, so another
+                    # worker is given the shard
+                    self._reissue(index)
+                    return
+                self._complete(index, result)
+
+    def _next_shard(self):
+        """
+        Wait for a shard that has not been handed out
+
+        Returns:
+            The index of the shard, or None once every shard has been merged
+        """
+        with self._condition:
+            while not self._pending:
+                if self._merged == len(self.shards):
+                    return None
+                self._condition.wait()
+            return self._pending.pop()
+
+    def _reissue(self, index):
+        """
+        Put a shard back so another worker can run it
+
+        Args:
+            index: (int) The index of the shard
+        """
+        with self._condition:
+            if index not in self._results and index >= self._merged:
+                self._pending.append(index)
+            self._condition.notify_all()
+
+    def _complete(self, index, result):
+        """
+        Store the result of a shard and merge every shard that is now next
+        in order
+
+        Args:
+            index: (int) The index of the shard
+            result: (dict) The result of run_shard
+        """
+        with self._condition:
+            if index >= self._merged:
+                self._results[index] = result
+            while self._merged in self._results:
+                shard = self._results.pop(self._merged)
+                self.photo_stats.extend(shard["photo_stats"])
+                self.cold_stats.extend(shard["cold_stats"])
+                self.jean_stats.extend(shard["jean_stats"])
+                for loss_map in shard["maps"]:
+                    self.loss_maps = self.loss_maps + loss_map
+                if "photo_phi" in shard:
+                    self.selected = shard
+                self._merged += 1
+            self._condition.notify_all()
+
+
+def work(address, authkey, timeout=HANDSHAKE_TIMEOUT):
+    """
+    Run shards handed out by a coordinator until it has none left
+
+    Args:
+        address: (tuple) The host and port of the coordinator
+        authkey: (bytes) The key printed by the coordinator
+        timeout: (float) The number of seconds to wait while connecting to
+        the coordinator (Set to HANDSHAKE_TIMEOUT by default)
+    """
+    with connect(address, authkey, timeout) as connection:
+        while True:
+            try:
+                shard = connection.recv()
+                if shard is None:
+                    return
+                connection.send(run_shard(**shard))
+            except (OSError, EOFError):
+                # The coordinator has closed the connection, either because
+                # this worker took too long and its shard was reissued or
+                # because every shard has been merged
+                return
+
+
+def connect(address, authkey, timeout=HANDSHAKE_TIMEOUT):
+    """
+    Connect and authenticate to a coordinator
+
+    Args:
+        address: (tuple) The host and port of the coordinator
+        authkey: (bytes) The key printed by the coordinator
+        timeout: (float) The number of seconds to wait while connecting
+        (Set to HANDSHAKE_TIMEOUT by default)
+
+    Returns:
+        The connection to the coordinator
+    """
+    sock = socket.create_connection(address, timeout=timeout)
+    return _handshake(sock, authkey, False, timeout)
+
+
+def _handshake(sock, authkey, server, timeout):
+    """
+    Run the authentication handshake of multiprocessing.connection on a new
+    socket, giving up if it does not finish in time
+
+    Args:
+        sock: (socket) The newly connected socket
+        authkey: (bytes) The key both ends must share
+        server: (bool) Whether this end is the coordinator
+        timeout: (float) The number of seconds the handshake may take
+
+    Returns:
+        The authenticated connection
+    """
+
+    # Connections need a blocking socket, so the time limit is enforced by
+    # shutting the socket down from a timer, which wakes any blocked read
+    sock.settimeout(None)
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    watchdog = threading.Timer(timeout, expire)
+    watchdog.start()
+    connection = Connection(os.dup(sock.fileno()))
+    try:
+        if server:
+            deliver_challenge(connection, authkey)
+            answer_challenge(connection, authkey)
+        else:
+            answer_challenge(connection, authkey)
+            deliver_challenge(connection, authkey)
+    except (AuthenticationError, OSError, EOFError):
+        watchdog.cancel()
+        watchdog.join()
+        connection.close()
+        sock.close()
+        if expired.is_set():
+            raise TimeoutError(f"handshake took longer than {timeout} seconds")
+        raise
+    watchdog.cancel()
+    watchdog.join()
+    sock.close()
+    if expired.is_set():
+        connection.close()
+        raise TimeoutError(f"handshake took longer than {timeout} seconds")
+    return connection
+
+
+def check_localhost(runs=5, simulations=12, seed=7, molecules=2000):
+    """
+    Check that a sharded ensemble on localhost gives the same results as
+    simulate, while one worker dies partway through a shard, one connects
+    with the wrong key, and one connects without ever authenticating
+
+    Args:
+        runs: (int) The number of hops the volatiles in the simulation will make
+        simulations: (int) The number of times to run the simulation
+        seed: (int) The seed for the ensemble
+        molecules: (int) The number of volatiles in each simulation, kept
+        small so the check is quick
+
+    Raises:
+        AssertionError: If any of the results differ
+    """
+    default_molecules = agents.N_MOLECULE
+    agents.N_MOLECULE = molecules
+    try:
+        expected = simulate(runs, simulations, seed=seed)
+        expected_maps = np.zeros((3, *MAP_BINS))
+        for i in range(simulations):
+            expected_maps = expected_maps + loss_maps(run_simulation(runs, i, seed))
+
+        coordinator = Coordinator(
+            runs,
+            simulations,
+            seed,
+            shard_size=3,
+            authkey=os.urandom(32),
+            handshake_timeout=1,
+        )
+        failures = []
+
+        def wrong_key():
+            try:
+                connect(coordinator.address, b"wrong key").close()
+            except AuthenticationError:
+                failures.append("wrong key")
+
+        def dying_worker():
+            # Take a shard and disconnect without returning it
+            with connect(coordinator.address, coordinator.authkey) as connection:
+                connection.recv()
+
+        outcome = []
+        server = threading.Thread(
+            target=lambda: outcome.append(coordinator.serve(worker_timeout=30))
+        )
+        server.start()
+
+        # Connections that misbehave come first so that the healthy worker
+        # has to get past them
+        idle = socket.create_connection(coordinator.address)
+        for target in (wrong_key, dying_worker):
+            thread = threading.Thread(target=target)
+            thread.start()
+            thread.join()
+        work(coordinator.address, coordinator.authkey)
+        server.join()
+        (results,) = outcome
+
+        # The coordinator should have hung up on the idle connection
+        idle.settimeout(5)
+        while idle.recv(4096):
+            pass
+        idle.close()
+    finally:
+        agents.N_MOLECULE = default_molecules
+
+    assert failures == ["wrong key"], "a connection with the wrong key got in"
+    for i, (actual, wanted) in enumerate(zip(results, expected)):
+        # Loss positions start with an uninitialized dummy value
+        if i >= 3:
+            actual, wanted = actual[1:], wanted[1:]
+        assert np.array_equal(actual, wanted), f"result {i} differs from simulate"
+    assert np.array_equal(coordinator.loss_maps, expected_maps), "loss maps differ"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run shards for a coordinator")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker = commands.add_parser("worker", help="Run shards for a coordinator")
+    worker.add_argument("host", help="The host the coordinator is running on")
+    worker.add_argument("port", type=int, help="The port the coordinator is using")
+    worker.add_argument(
+        "--authkey", required=True, help="The key printed by the coordinator"
+    )
+    commands.add_parser("check", help="Check a sharded ensemble on localhost")
+    arguments = parser.parse_args()
+    if arguments.command == "worker":
+        work((arguments.host, arguments.port), bytes.fromhex(arguments.authkey))
+    else:
+        check_localhost()
+        print("Sharded results match simulate")
@@ -0,0 +1,159 @@
+"""
+Defines a continuous source of volatiles for steady-state simulations
+"""
+import warnings
+import numpy as np
+from src.agents import N_MOLECULE, trajectory
+from src.migrate import is_cold_trapped, is_escaping, photo_probability
+from src.streams import RandomStreams
+
+
+def uniform_distribution(generator, count):
+    """
+    Spread new volatiles evenly across the surface of Mercury
+
+    Args:
+        generator: (Generator) The generator used to place the volatiles
+        count: (int) The number of volatiles to place
+
+    Returns:
+        The lattitude and longitude angles of the new volatiles
+    """
+    theta = generator.random(count) * 2 * np.pi
+    phi = np.arccos(1 - 2 * generator.random(count))
+    return phi, theta
+
+
+class ContinuousSource:
+
+    """
+    Define a steady supply of volatiles that are released onto the surface
+    of Mercury every hop, reusing the slots of the volatiles that are lost
+    """
+
+    def __init__(
+        self,
+        rate,
+        capacity=N_MOLECULE,
+        seed=None,
+        prefetch=False,
+        distribution=uniform_distribution,
+        volatile="water",
+    ):
+        """
+        Set up the preallocated slots that volatiles are released into
+
+        Args:
+            rate: (int) The number of volatiles released every hop
+            capacity: (int) The largest number of volatiles that can be active
+            at once, which should be above the steady-state population
+            (Set to N_MOLECULE by default)
+            seed: (int) The seed for the random streams of this simulation
+            (Set to fresh entropy by default)
+            prefetch: (bool) Whether or not to draw the random numbers for
+            the next hop on a worker thread while the current hop is calculated
+            distribution: A function taking a generator and a count that returns
+            the lattitude and longitude of new volatiles (Set to an even spread
+            across the surface by default)
+            volatile: (string) The specified volatile used in the simulation
+            (Set to water by default)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.distribution = distribution
+        self.volatile = volatile
+        self.streams = RandomStreams(capacity, seed, prefetch)
+        self.phi = np.zeros(capacity, dtype=float)
+        self.theta = np.zeros(capacity, dtype=float)
+        self.active = np.zeros(capacity, dtype=bool)
+
+        # The free slots are kept as a stack so that releasing and reusing
+        # slots never has to search the arrays
+        self._free = np.arange(capacity)[::-1].copy()
+        self._free_count = capacity
+
+        # Running totals recorded once per hop
+        self.inventory = []
+        self.jeans_rate = []
+        self.cold_rate = []
+        self.photo_rate = []
+        self.dropped = 0
+
+    def inject(self, count):
+        """
+        Release new volatiles into free slots
+
+        Args:
+            count: (int) The number of volatiles to release
+
+        Returns:
+            The number of volatiles that fit into the free slots. Any that do
+            not fit are counted in dropped and a RuntimeWarning is issued.
+        """
+        fitted = min(count, self._free_count)
+        if fitted < count:
+            # The inventory is capped by the capacity rather than set by the
+            # losses, so the running statistics no longer describe a steady state
+            warnings.warn(
+                "capacity is full so new volatiles are being dropped and the "
+                "inventory is not a steady state; increase capacity",
+                RuntimeWarning,
+            )
+        self.dropped += count - fitted
+        slots = self._free[self._free_count - fitted : self._free_count]
+        self._free_count -= fitted
+        self.phi[slots], self.theta[slots] = self.distribution(
+            self.streams.position, fitted
+        )
+        self.active[slots] = True
+        return fitted
+
+    def release(self, slots):
+        """
+        Free the slots of volatiles that have been lost
+
+        Args:
+            slots: (int) The indices of the slots to free
+        """
+        self.active[slots] = False
+        self._free[self._free_count : self._free_count + np.size(slots)] = slots
+        self._free_count += np.size(slots)
+
+    def migrate(self, mass: float):
+        """
+        Release a new set of volatiles and allow every active volatile to
+        undergo a hop
+
+        Args:
+            mass: (float) The specific particle mass in kilograms
+            of a specific volatile
+        """
+        self.inject(self.rate)
+        slots = np.flatnonzero(self.active)
+        normal, probability, angle, heading = self.streams.next_hop(np.size(slots))
+
+        # The same hop as a single pulse of volatiles, except that lost
+        # volatiles are marked rather than removed from the arrays
+        temperature, velocity, emergent_angle, time, phi, theta = trajectory(
+            self.phi[slots], self.theta[slots], mass, normal, angle, heading
+        )
+        self.phi[slots] = phi
+        self.theta[slots] = theta
+
+        # Each volatile can only be lost through one method, checked in the
+        # same order as for a single pulse
+        jeans = is_escaping(velocity, emergent_angle)
+        cold = is_cold_trapped(temperature) & ~jeans
+        photo = (probability < photo_probability(time, self.volatile)) & ~(jeans | cold)
+        self.release(slots[jeans | cold | photo])
+
+        self.inventory.append(self.capacity - self._free_count)
+        self.jeans_rate.append(np.count_nonzero(jeans))
+        self.cold_rate.append(np.count_nonzero(cold))
+        self.photo_rate.append(np.count_nonzero(photo))
+
+    def close(self):
+        """
+        Release the worker thread used to prefetch random numbers, if any
+        """
+        self.streams.close()
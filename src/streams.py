@@ -0,0 +1,134 @@
+"""
+Seeded random number streams for the volatile simulation
+"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+class RandomStreams:
+
+    """
+    Independent random streams for every random quantity drawn during a hop,
+    with the option of filling the next hop's draws on a worker thread
+    """
+
+    def __init__(self, size, seed=None, prefetch=False):
+        """
+        Spawn a separate generator for every random stream in the simulation
+
+        Args:
+            size: (int) The number of volatiles at the start of the simulation
+            seed: (int) The seed for the simulation, or a SeedSequence to spawn
+            the streams from (Set to fresh entropy by default)
+            prefetch: (bool) Whether or not to draw the next hop's random
+            numbers on a worker thread while the current hop is calculated
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        position, velocity, photo, angle = seed.spawn(4)
+        self.position = np.random.default_rng(position)
+        self._velocity = np.random.default_rng(velocity)
+        self._photo = np.random.default_rng(photo)
+        self._angle = np.random.default_rng(angle)
+        (self._chunk,) = seed.spawn(1)
+        self.weighting = np.random.default_rng(seed.spawn(1)[0])
+
+        # With prefetching two sets of buffers are kept so that the worker can
+        # fill one while the current hop reads from the other. Buffers are only
+        # allocated once they are filled, so chunked runs that never call
+        # next_hop do not pay for them.
+        buffers = 2 if prefetch else 1
+        self._normal = [np.empty(0) for i in range(buffers)]
+        self._uniform = [np.empty(0) for i in range(buffers)]
+        self._index = 0
+
+        # The population can only shrink between hops unless volatiles are
+        # split, so the size of the previous hop is drawn ahead of time and
+        # any shortfall is topped up when the hop starts. Drawing the same
+        # amounts keeps the streams identical whether or not prefetching
+        # is enabled.
+        self._bound = size
+        self._executor = None
+        self._pending = None
+        if prefetch:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._pending = self._executor.submit(self._fill, 0, size)
+
+    def next_hop(self, size):
+        """
+        Collect the random numbers needed for a single hop
+
+        Args:
+            size: (int) The number of volatiles still active in the simulation
+
+        Returns:
+            The standard normal variates for the launch velocity, the uniform
+            variates for photodestruction, the uniform variate for the emergent
+            angle, and the heading direction. The arrays are only valid until
+            the next call.
+        """
+        if self._executor is None:
+            normal, uniform, angle, heading = self._fill(self._index, self._bound)
+        else:
+            normal, uniform, angle, heading = self._pending.result()
+        if size > self._bound:
+            extra = size - self._bound
+            normal = np.concatenate((normal, self._velocity.standard_normal(extra)))
+            uniform = np.concatenate((uniform, self._photo.random(extra)))
+        if self._executor is not None:
+            self._pending = self._executor.submit(self._fill, 1 - self._index, size)
+        self._index = (self._index + 1) % len(self._normal)
+        self._bound = size
+        return normal[:size], uniform[:size], angle, heading
+
+    def hop_angles(self):
+        """
+        Draw the random numbers shared by every volatile in a hop
+
+        Returns:
+            The uniform variate for the emergent angle and the heading direction
+        """
+        return self._angle.uniform(), self._angle.uniform(0, 2 * np.pi)
+
+    def chunk_generators(self, count):
+        """
+        Spawn independent generators for the chunks of a single hop
+
+        Args:
+            count: (int) The number of chunks the volatiles are split into
+
+        Returns:
+            A list of generators, one for each chunk
+        """
+        return [np.random.default_rng(child) for child in self._chunk.spawn(count)]
+
+    def close(self):
+        """
+        Stop the worker thread if one was started
+        """
+        if self._executor is not None:
+            self._pending.cancel()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _fill(self, index, size):
+        """
+        Draw one hop's worth of random numbers into a set of buffers
+
+        Args:
+            index: (int) Which of the two sets of buffers to fill
+            size: (int) The number of random numbers to draw for each array
+
+        Returns:
+            The filled normal and uniform buffers as well as the uniform variate
+            for the emergent angle and the heading direction for the hop
+        """
+        if np.size(self._normal[index]) < size:
+            self._normal[index] = np.empty(size)
+            self._uniform[index] = np.empty(size)
+        normal = self._normal[index][:size]
+        uniform = self._uniform[index][:size]
+        self._velocity.standard_normal(out=normal)
+        self._photo.random(out=uniform)
+        angle, heading = self.hop_angles()
+        return normal, uniform, angle, heading